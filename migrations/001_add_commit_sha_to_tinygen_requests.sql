@@ -0,0 +1,3 @@
+-- Records the commit each diff was generated against, used by the prompt cache to only reuse
+-- diffs for the exact same code.
+alter table tinygen_requests add column if not exists commit_sha text;
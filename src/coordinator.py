@@ -0,0 +1,123 @@
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import Response
+
+import httpx
+import logging
+import os
+
+from request_data import RequestData
+from sharding import ConsistentHashRing, LocalCoordinationStore, MAX_INFLIGHT, OVERLOADED_HEADER
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+
+
+app = FastAPI()
+
+# Seconds to wait for a worker's answer, generation with reflection can take minutes
+WORKER_TIMEOUT = float(os.environ.get("TINYGEN_WORKER_TIMEOUT", "600"))
+
+store = LocalCoordinationStore()
+ring = ConsistentHashRing()
+
+
+def refresh_ring():
+    """
+    Rebuilds the ring from the live workers in the coordination store.
+    Workers that joined are added and workers whose heartbeat expired are removed,
+    so only the repos owned by those workers move to a new owner.
+    """
+    workers = store.live_workers()
+
+    for worker_id in set(workers) - ring.nodes:
+        logging.info(f"Worker {worker_id} joined the ring")
+        ring.add_node(worker_id)
+    for worker_id in ring.nodes - set(workers):
+        logging.info(f"Worker {worker_id} left the ring, rebalancing its repos")
+        ring.remove_node(worker_id)
+
+    return workers
+
+
+def route(repo_url):
+    """
+    Returns the workers to try for repo_url, best first.
+    The owner comes first unless it is overloaded, in which case the next workers on the ring
+    with spare capacity are preferred. Overloaded workers are kept at the end, least loaded first.
+    """
+    workers = refresh_ring()
+    preference = ring.preference_list(repo_url)
+
+    available = [w for w in preference if workers[w]["inflight"] < MAX_INFLIGHT]
+    overloaded = sorted(
+        (w for w in preference if w not in available),
+        key=lambda w: workers[w]["inflight"],
+    )
+    if preference and preference[0] not in available:
+        logging.warning(f"Owner {preference[0]} of {repo_url} is overloaded, falling back")
+
+    return [workers[w] for w in available + overloaded]
+
+
+async def forward(path, data: RequestData):
+    candidates = route(data.repoUrl)
+    if not candidates:
+        raise HTTPException(status_code=503, detail="No TinyGen workers are available.")
+
+    # Generating a diff is expensive and not safe to repeat, so the next worker is only tried
+    # when the request never reached this one or the worker refused it because it was full.
+    skipped = []
+    async with httpx.AsyncClient(timeout=WORKER_TIMEOUT) as client:
+        for worker in candidates:
+            worker_id = worker["worker_id"]
+            try:
+                logging.info(f"Routing {data.repoUrl} to worker {worker_id}")
+                response = await client.post(f"{worker['url']}{path}", json=data.model_dump())
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                logging.error(f"Worker {worker_id} is unreachable: {type(e).__name__} {e}")
+                skipped.append(f"{worker_id} (unreachable)")
+                continue  # Try the next worker on the ring
+            except httpx.TimeoutException as e:
+                logging.error(f"Worker {worker_id} timed out: {type(e).__name__}")
+                raise HTTPException(
+                    status_code=504, detail=f"Worker {worker_id} did not answer in time."
+                ) from e
+            except httpx.TransportError as e:
+                logging.error(f"Request to worker {worker_id} failed: {type(e).__name__} {e}")
+                raise HTTPException(
+                    status_code=502, detail=f"Request to worker {worker_id} failed: {type(e).__name__}"
+                ) from e
+
+            if response.status_code == 503 and OVERLOADED_HEADER in response.headers:
+                logging.warning(f"Worker {worker_id} is overloaded, trying the next one")
+                skipped.append(f"{worker_id} (overloaded)")
+                continue  # Try the next worker on the ring
+
+            # Pass the worker's answer through unchanged, errors included, it is not always JSON
+            return Response(
+                content=response.content,
+                status_code=response.status_code,
+                media_type=response.headers.get("content-type"),
+                headers={"X-TinyGen-Worker": worker_id},
+            )
+
+    raise HTTPException(
+        status_code=503,
+        detail=f"No TinyGen worker could take the request: {', '.join(skipped)}",
+    )
+
+
+@app.post("/generate-diff")
+async def generate_diff(data: RequestData):
+    return await forward("/generate-diff", data)
+
+
+@app.post("/generate-diff-no-code")
+async def generate_diff_no_code(data: RequestData):
+    return await forward("/generate-diff-no-code", data)
+
+
+@app.get("/workers")
+async def list_workers():
+    return refresh_ring()
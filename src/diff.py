@@ -1,5 +1,6 @@
 import logging
 import os
+import re
 
 from fastapi import HTTPException
 from llm import GPT4oClient
@@ -179,3 +180,27 @@ def check_diff_fixes_issue(diff, prompt, max_retries=5):
         f"Failed to generate a diff that fixes the issue after {max_retries} attempts."
     )
     return False  # Failed to fix the issue
+
+
+def validate_cached_diff(diff, prompt, cached_prompt):
+    """
+    Calls the LLM once to verify whether a diff cached for a similar prompt also solves this prompt.
+    Unlike check_diff_fixes_issue, only an explicit "VERDICT: YES" on the last line accepts the diff:
+    anything else, including errors, rejects it so the full pipeline runs instead.
+    """
+    validation_prompt = generate_reuse_validation_prompt(prompt, cached_prompt, diff)
+
+    try:
+        validation_result = llm_client.create_completion(validation_prompt)
+    except Exception as e:
+        logging.error(f"Error during cached diff validation: {e}")
+        return False
+
+    lines = validation_result.strip().splitlines()
+    verdict = re.fullmatch(r"\W*verdict\W*(yes|no)\W*", lines[-1].strip().lower()) if lines else None
+    if verdict and verdict.group(1) == "yes":
+        logging.info("The cached diff addresses the prompt.")
+        return True
+
+    logging.warning(f"Cached diff rejected by validation: {validation_result}")
+    return False
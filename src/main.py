@@ -4,12 +4,23 @@ from git import Repo
 import os
 import shutil
 import logging
+import uuid
 
 from supabase import create_client, Client
 from dotenv import load_dotenv
 from utils.tools import output_modified_code
 from diff import *
 from request_data import RequestData
+from sharding import (
+    TINYGEN_MODE,
+    WORKER_ID,
+    ConsistentHashRing,
+    LocalCoordinationStore,
+    checkout_repo,
+    register_worker,
+    worker_path,
+)
+from prompt_cache import CACHE_ENABLED, PromptCache
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -19,6 +30,10 @@ load_dotenv()
 
 app = FastAPI()
 
+# In worker mode, join the coordination store so the coordinator can route repos to this process
+if TINYGEN_MODE == "worker":
+    register_worker(app)
+
 
 # Set up Supabase credentials ================================================
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
@@ -33,123 +48,203 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 #  ================================================
 
+# Cleared when the tinygen_requests table has not been migrated yet (migrations/001_add_commit_sha_to_tinygen_requests.sql)
+commit_sha_supported = True
 
-@app.post("/generate-diff")
-async def generate_diff(data: RequestData):
-    repo_url = data.repoUrl
-    prompt = data.prompt
-    repo_dir_a = "a"  # Folder for the first clone (unchanged)
-    repo_dir_b = "b"  # this is where the modified code will be stored
 
-    # Clean up any existing repo directory
-    if os.path.exists(repo_dir_a):
-        shutil.rmtree(repo_dir_a)
-    if os.path.exists(repo_dir_b):
-        shutil.rmtree(repo_dir_b)
+def insert_request(data_to_store):
+    """
+    Inserts a request into the tinygen_requests table.
+    Falls back to storing it without commit_sha when the column does not exist yet.
+    """
+    global commit_sha_supported
 
-    # Clone the repository
-    try:
-        logging.info(f"Cloning the repository into {repo_dir_a}...")
-        Repo.clone_from(repo_url, repo_dir_a)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to clone repository into {repo_dir_a}: {e}")
+    if not commit_sha_supported:
+        data_to_store = {k: v for k, v in data_to_store.items() if k != "commit_sha"}
 
-    # Clone the repository again into 'repo_b'
     try:
-        logging.info(f"Cloning the repository into {repo_dir_b}...")
-        Repo.clone_from(repo_url, repo_dir_b)
+        return supabase.table("tinygen_requests").insert(data_to_store).execute()
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to clone repository into {repo_dir_b}: {e}")
-
+        if "commit_sha" not in data_to_store or "commit_sha" not in str(e):
+            raise
+        logging.warning(
+            "The tinygen_requests table has no commit_sha column, storing requests without it. "
+            "Run migrations/001_add_commit_sha_to_tinygen_requests.sql to fix this."
+        )
+        commit_sha_supported = False
+        return insert_request(data_to_store)
+
+
+prompt_cache = PromptCache()
+
+
+@app.on_event("startup")
+async def warm_prompt_cache():
+    if not CACHE_ENABLED:
+        return
+
+    if TINYGEN_MODE != "worker":
+        prompt_cache.warm_from_history(supabase)
+        return
+
+    # A worker only serves the repos it owns on the ring, so it only loads their history.
+    # Ownership is taken from the workers live at startup; repos it gains later fill the cache as they are served.
+    ring = ConsistentHashRing(LocalCoordinationStore().live_workers())
+    ring.add_node(WORKER_ID)
+    prompt_cache.warm_from_history(
+        supabase, owns_repo=lambda repo_url: ring.owner(repo_url) == WORKER_ID
+    )
 
-    initial_diff = generate_initial_diff(prompt, repo_dir_a)
-    final_diff, summary = reflection_step(initial_diff, prompt)
-    
-    
-    # shutil.rmtree(repo_dir)  # Clean up the repo directory
-    # The line `# output_modified_code(repo_dir, final_diff)` is a commented-out line in the code
-    # snippet you provided. It appears to be a placeholder or a reminder for a function or operation
-    # that was intended to be implemented but is currently not being used.
-    output_modified_code(repo_dir_b, final_diff)
-
-    data_to_store = {
-        "repo_url": repo_url,
-        "prompt": prompt,
-        "diff": final_diff,
-        "summary": summary,
-    }
-
-    # Attempt to store the data in Supabase
-    try:
-        response = supabase.table("tinygen_requests").insert(data_to_store).execute()
 
-        # Check if any data was returned (meaning success)
-        if not response.data:
-            logging.error(f"Failed to insert data into Supabase: {response}")
-            raise HTTPException(
-                status_code=500, detail="Failed to store data in Supabase."
+def generate_or_reuse_diff(repo_url, commit_sha, prompt, repo_dir):
+    """
+    Reuses the diff of a near-duplicate prompt asked against the same repo and commit when one is cached
+    and passes a single validation call. Otherwise runs the full generation and reflection pipeline.
+    """
+    if CACHE_ENABLED:
+        cached, similarity = prompt_cache.lookup(repo_url, commit_sha, prompt)
+        if cached:
+            logging.info(
+                f"Found cached diff for a similar prompt ({similarity:.2f}): '{cached['prompt']}'"
             )
+            accepted = validate_cached_diff(cached["diff"], prompt, cached["prompt"])
+            prompt_cache.record_validation(accepted)
+            if accepted:
+                return cached["diff"], cached["summary"]
+            logging.info("Cached diff does not address the prompt, generating a new one.")
 
-        logging.info("Data successfully inserted into Supabase.")
-
-    except Exception as e:
-        logging.error(f"Error inserting data into Supabase: {e}")
-        raise HTTPException(status_code=500, detail="Failed to store data in Supabase.")
-
-    logging.info("DIFF GENERATED")
-    print(final_diff)
+    initial_diff = generate_initial_diff(prompt, repo_dir)
+    final_diff, summary = reflection_step(initial_diff, prompt)
 
-    return {"summary": summary, "diff": final_diff}
+    if CACHE_ENABLED:
+        prompt_cache.add(repo_url, commit_sha, prompt, final_diff, summary)
 
+    return final_diff, summary
 
 
-# This endpoint generates the diff without storing the fixed code in the repository
-@app.post("/generate-diff-no-code")
-async def generate_diff_no_code(data: RequestData):
+# Endpoints are plain functions so FastAPI runs them in its threadpool: the git, OpenAI and Supabase
+# calls are blocking, and an async endpoint would make the server handle one request at a time.
+@app.post("/generate-diff")
+def generate_diff(data: RequestData):
     repo_url = data.repoUrl
     prompt = data.prompt
-    repo_dir = "temp_repo"
-
-    # Clean up any existing repo directory
-    if os.path.exists(repo_dir):
-        shutil.rmtree(repo_dir)
+    # Every request gets its own folder since several requests can run at the same time
+    request_dir = worker_path(f"request_{uuid.uuid4().hex}")
+    repo_dir_a = os.path.join(request_dir, "a")  # Folder for the first clone (unchanged)
+    repo_dir_b = os.path.join(request_dir, "b")  # this is where the modified code will be stored
 
-    # Clone the repository
     try:
-        Repo.clone_from(repo_url, repo_dir)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to clone repository: {e}")
+        # Clone the repository
+        try:
+            logging.info(f"Cloning the repository into {repo_dir_a}...")
+            checkout_repo(repo_url, repo_dir_a)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to clone repository into {repo_dir_a}: {e}")
+
+        # Clone the repository again into 'repo_b'
+        try:
+            logging.info(f"Cloning the repository into {repo_dir_b}...")
+            checkout_repo(repo_url, repo_dir_b)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to clone repository into {repo_dir_b}: {e}")
+
+        commit_sha = Repo(repo_dir_a).head.commit.hexsha
+        final_diff, summary = generate_or_reuse_diff(repo_url, commit_sha, prompt, repo_dir_a)
+    
+    
+        # shutil.rmtree(repo_dir)  # Clean up the repo directory
+        # The line `# output_modified_code(repo_dir, final_diff)` is a commented-out line in the code
+        # snippet you provided. It appears to be a placeholder or a reminder for a function or operation
+        # that was intended to be implemented but is currently not being used.
+        output_modified_code(repo_dir_b, final_diff)
 
-    initial_diff = generate_initial_diff(prompt, repo_dir)
-    final_diff, summary = reflection_step(initial_diff, prompt)
-    shutil.rmtree(repo_dir)  # Clean up the repo directory
-    # output_modified_code(repo_dir, final_diff)
+        data_to_store = {
+            "repo_url": repo_url,
+            "commit_sha": commit_sha,
+            "prompt": prompt,
+            "diff": final_diff,
+            "summary": summary,
+        }
 
-    data_to_store = {
-        "repo_url": repo_url,
-        "prompt": prompt,
-        "diff": final_diff,
-        "summary": summary,
-    }
+        # Attempt to store the data in Supabase
+        try:
+            response = insert_request(data_to_store)
 
-    # Attempt to store the data in Supabase
-    try:
-        response = supabase.table("tinygen_requests").insert(data_to_store).execute()
+            # Check if any data was returned (meaning success)
+            if not response.data:
+                logging.error(f"Failed to insert data into Supabase: {response}")
+                raise HTTPException(
+                    status_code=500, detail="Failed to store data in Supabase."
+                )
 
-        # Check if any data was returned (meaning success)
-        if not response.data:
-            logging.error(f"Failed to insert data into Supabase: {response}")
-            raise HTTPException(
-                status_code=500, detail="Failed to store data in Supabase."
-            )
+            logging.info("Data successfully inserted into Supabase.")
 
-        logging.info("Data successfully inserted into Supabase.")
+        except Exception as e:
+            logging.error(f"Error inserting data into Supabase: {e}")
+            raise HTTPException(status_code=500, detail="Failed to store data in Supabase.")
 
-    except Exception as e:
-        logging.error(f"Error inserting data into Supabase: {e}")
-        raise HTTPException(status_code=500, detail="Failed to store data in Supabase.")
+        logging.info("DIFF GENERATED")
+        print(final_diff)
 
-    logging.info("DIFF GENERATED")
-    print(final_diff)
+        return {"summary": summary, "diff": final_diff}
+    finally:
+        # Nothing in the request folder is used after the response, also clean up when the request fails
+        shutil.rmtree(request_dir, ignore_errors=True)
 
-    return {"summary": summary, "diff": final_diff}
\ No newline at end of file
+
+@app.get("/cache-stats")
+async def cache_stats():
+    return prompt_cache.stats()
+
+
+# This endpoint generates the diff without storing the fixed code in the repository
+@app.post("/generate-diff-no-code")
+def generate_diff_no_code(data: RequestData):
+    repo_url = data.repoUrl
+    prompt = data.prompt
+    request_dir = worker_path(f"request_{uuid.uuid4().hex}")
+    repo_dir = os.path.join(request_dir, "temp_repo")
+
+    try:
+        # Clone the repository
+        try:
+            checkout_repo(repo_url, repo_dir)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Failed to clone repository: {e}")
+
+        commit_sha = Repo(repo_dir).head.commit.hexsha
+        final_diff, summary = generate_or_reuse_diff(repo_url, commit_sha, prompt, repo_dir)
+        # output_modified_code(repo_dir, final_diff)
+
+        data_to_store = {
+            "repo_url": repo_url,
+            "commit_sha": commit_sha,
+            "prompt": prompt,
+            "diff": final_diff,
+            "summary": summary,
+        }
+
+        # Attempt to store the data in Supabase
+        try:
+            response = insert_request(data_to_store)
+
+            # Check if any data was returned (meaning success)
+            if not response.data:
+                logging.error(f"Failed to insert data into Supabase: {response}")
+                raise HTTPException(
+                    status_code=500, detail="Failed to store data in Supabase."
+                )
+
+            logging.info("Data successfully inserted into Supabase.")
+
+        except Exception as e:
+            logging.error(f"Error inserting data into Supabase: {e}")
+            raise HTTPException(status_code=500, detail="Failed to store data in Supabase.")
+
+        logging.info("DIFF GENERATED")
+        print(final_diff)
+
+        return {"summary": summary, "diff": final_diff}
+    finally:
+        # Nothing in the request folder is used after the response, also clean up when the request fails
+        shutil.rmtree(request_dir, ignore_errors=True)
\ No newline at end of file
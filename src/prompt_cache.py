@@ -0,0 +1,224 @@
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from dotenv import load_dotenv
+from sharding import normalize_repo_url
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+load_dotenv()
+
+
+# Prompt cache configuration ================================================
+CACHE_ENABLED = os.environ.get("TINYGEN_CACHE_ENABLED", "true").lower() == "true"
+CACHE_THRESHOLD = float(os.environ.get("TINYGEN_CACHE_THRESHOLD", "0.8"))
+CACHE_MAX_PER_REPO = int(os.environ.get("TINYGEN_CACHE_MAX_PER_REPO", "100"))
+CACHE_MAX_REPOS = int(os.environ.get("TINYGEN_CACHE_MAX_REPOS", "50"))
+CACHE_HISTORY_LIMIT = int(os.environ.get("TINYGEN_CACHE_HISTORY_LIMIT", "500"))
+#  ================================================
+
+# Words that never change what a prompt asks for. Everything else, including "to", "from" or "and", is kept
+FILLER_WORDS = {"a", "an", "the", "please"}
+
+# Character n-gram sizes. N-grams span word boundaries, so word order is part of the vector
+NGRAM_SIZES = (3, 4, 5)
+
+
+def extract_terms(prompt):
+    """
+    Turns a prompt into a bag of character n-grams over its normalized text
+    (lowercase words separated by single spaces, filler words dropped).
+    Punctuation, case and spelling variants such as "utils" / "utils.py" share most n-grams,
+    while swapping words ("rename foo to bar" / "rename bar to foo") changes the n-grams around them.
+    """
+    words = [word for word in re.findall(r"[a-z0-9_]+", prompt.lower()) if word not in FILLER_WORDS]
+    text = f" {' '.join(words)} "
+
+    terms = Counter()
+    for size in NGRAM_SIZES:
+        for i in range(len(text) - size + 1):
+            terms[text[i:i + size]] += 1
+    return terms
+
+
+def cosine_similarity(a, b):
+    if not a or not b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(weight * b.get(term, 0) for term, weight in a.items())
+    norm_a = math.sqrt(sum(weight * weight for weight in a.values()))
+    norm_b = math.sqrt(sum(weight * weight for weight in b.values()))
+    return dot / (norm_a * norm_b)
+
+
+class PromptCache:
+    def __init__(
+        self,
+        threshold=CACHE_THRESHOLD,
+        max_per_repo=CACHE_MAX_PER_REPO,
+        max_repos=CACHE_MAX_REPOS,
+    ):
+        """
+        Near-duplicate cache of previous (repo, commit, prompt) -> diff results.
+        Entries are partitioned per repo and commit, so a prompt is only ever compared with prompts
+        asked against the exact same code.
+        At most max_repos repos are kept, least recently used first out. Each repo keeps at most
+        max_per_repo entries over all its commits: the least recently used commits (usually the older
+        ones, since requests move on to the latest commit) are emptied first.
+
+        Prompts are compared with TF-IDF weighted cosine similarity of their character n-grams, where the
+        document frequencies come from every cached prompt of the same repo: n-grams found in most prompts
+        of a repo ("add ", "fix"...) weigh less than the ones telling the prompts apart ("utils", "main"...).
+        This is a lexical match: it catches rewordings of the same text, not synonyms, and the reused diff
+        is still validated before it is returned.
+        """
+        self.threshold = threshold
+        self.max_per_repo = max_per_repo
+        self.max_repos = max_repos
+        self._repos = OrderedDict()  # repo -> OrderedDict(commit -> OrderedDict(prompt -> entry))
+        self._doc_freq = {}  # repo -> Counter(term -> number of cached prompts containing it)
+        self._doc_count = Counter()  # repo -> number of cached prompts
+        self._lock = threading.Lock()
+        self.metrics = Counter()
+
+    def _index(self, repo, terms, delta):
+        self._doc_count[repo] += delta
+        doc_freq = self._doc_freq.setdefault(repo, Counter())
+        for term in terms:
+            doc_freq[term] += delta
+            if doc_freq[term] <= 0:
+                del doc_freq[term]
+        if self._doc_count[repo] <= 0:
+            del self._doc_count[repo]
+            del self._doc_freq[repo]
+
+    def _weigh(self, repo, terms):
+        # Smoothed IDF, terms never seen in the repo get the highest weight
+        doc_count = self._doc_count[repo]
+        doc_freq = self._doc_freq.get(repo, {})
+        return {
+            term: count * (math.log((doc_count + 1) / (doc_freq.get(term, 0) + 1)) + 1)
+            for term, count in terms.items()
+        }
+
+    def add(self, repo_url, commit, prompt, diff, summary):
+        if not diff:
+            return  # Nothing worth reusing when the pipeline failed
+
+        repo = normalize_repo_url(repo_url)
+        with self._lock:
+            commits = self._repos.setdefault(repo, OrderedDict())
+            self._repos.move_to_end(repo)
+            partition = commits.setdefault(commit, OrderedDict())
+            commits.move_to_end(commit)
+            if prompt in partition:
+                self._index(repo, partition[prompt]["terms"], -1)
+            partition[prompt] = {
+                "prompt": prompt,
+                "terms": extract_terms(prompt),
+                "diff": diff,
+                "summary": summary,
+            }
+            partition.move_to_end(prompt)
+            self._index(repo, partition[prompt]["terms"], 1)
+
+            # Oldest commits of the repo go first, then the oldest entries of its current commit
+            while self._doc_count[repo] > self.max_per_repo:
+                oldest_commit, oldest_partition = next(iter(commits.items()))
+                _, evicted = oldest_partition.popitem(last=False)
+                if not oldest_partition:
+                    del commits[oldest_commit]
+                self._index(repo, evicted["terms"], -1)
+                self.metrics["evictions"] += 1
+
+            while len(self._repos) > self.max_repos:
+                evicted_repo, evicted_commits = self._repos.popitem(last=False)
+                for evicted_partition in evicted_commits.values():
+                    for entry in evicted_partition.values():
+                        self._index(evicted_repo, entry["terms"], -1)
+                        self.metrics["evictions"] += 1
+
+    def lookup(self, repo_url, commit, prompt):
+        """
+        Returns (entry, similarity) for the most similar cached prompt at or above the threshold,
+        or (None, best_similarity) when there is no near-duplicate.
+        """
+        repo = normalize_repo_url(repo_url)
+        terms = extract_terms(prompt)
+        best_entry, best_score = None, 0.0
+
+        with self._lock:
+            self.metrics["lookups"] += 1
+            partition = self._repos.get(repo, {}).get(commit, {})
+            vector = self._weigh(repo, terms)
+            for entry in partition.values():
+                score = cosine_similarity(vector, self._weigh(repo, entry["terms"]))
+                if score > best_score:
+                    best_entry, best_score = entry, score
+
+            if best_entry is None or best_score < self.threshold:
+                self.metrics["misses"] += 1
+                return None, best_score
+
+            self._repos.move_to_end(repo)
+            self._repos[repo].move_to_end(commit)
+            partition.move_to_end(best_entry["prompt"])
+            return best_entry, best_score
+
+    def record_validation(self, accepted):
+        """
+        Records whether a near-duplicate diff passed validation. Only accepted candidates count as hits.
+        """
+        with self._lock:
+            self.metrics["hits" if accepted else "rejected"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.metrics["lookups"]
+            return {
+                "lookups": lookups,
+                "hits": self.metrics["hits"],
+                "misses": self.metrics["misses"],
+                "rejected": self.metrics["rejected"],
+                "evictions": self.metrics["evictions"],
+                "hit_rate": self.metrics["hits"] / lookups if lookups else 0.0,
+                "repos": len(self._repos),
+                "entries": sum(self._doc_count.values()),
+                "threshold": self.threshold,
+            }
+
+    def warm_from_history(self, supabase, limit=CACHE_HISTORY_LIMIT, owns_repo=None):
+        """
+        Loads the most recent successful requests from the tinygen_requests table into the cache.
+        When owns_repo is given, only the requests for repos it accepts are kept, out of the latest limit rows.
+        """
+        try:
+            response = (
+                supabase.table("tinygen_requests")
+                .select("repo_url, commit_sha, prompt, diff, summary")
+                .not_.is_("diff", "null")
+                .not_.is_("commit_sha", "null")
+                .order("id", desc=True)
+                .limit(limit)
+                .execute()
+            )
+        except Exception as e:
+            # Most likely the commit_sha column is missing, see migrations/001_add_commit_sha_to_tinygen_requests.sql
+            logging.warning(f"Failed to load request history into the prompt cache, starting empty: {e}")
+            return
+
+        rows = [
+            row for row in response.data or [] if owns_repo is None or owns_repo(row["repo_url"])
+        ]
+        # Oldest first so the most recent requests end up as the most recently used entries
+        for row in reversed(rows):
+            self.add(
+                row["repo_url"], row["commit_sha"], row["prompt"], row["diff"], row["summary"]
+            )
+        logging.info(f"Loaded {len(rows)} requests into the prompt cache.")
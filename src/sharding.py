@@ -0,0 +1,335 @@
+import bisect
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from dotenv import load_dotenv
+from fastapi.responses import JSONResponse
+from git import Repo
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+)
+load_dotenv()
+
+
+# Sharding configuration ================================================
+TINYGEN_MODE = os.environ.get("TINYGEN_MODE", "standalone")
+STORE_DIR = os.environ.get("TINYGEN_STORE_DIR", ".tinygen_store")
+CHECKOUT_DIR = os.environ.get("TINYGEN_CHECKOUT_DIR", ".tinygen_checkouts")
+HEARTBEAT_INTERVAL = float(os.environ.get("TINYGEN_HEARTBEAT_INTERVAL", "2"))
+MAX_INFLIGHT = int(os.environ.get("TINYGEN_MAX_INFLIGHT", "4"))
+VIRTUAL_NODES = int(os.environ.get("TINYGEN_VIRTUAL_NODES", "64"))
+MAX_CHECKOUTS = int(os.environ.get("TINYGEN_MAX_CHECKOUTS", "20"))
+
+# Only used in worker mode, where both are required
+WORKER_ID = os.environ.get("TINYGEN_WORKER_ID")
+WORKER_URL = os.environ.get("TINYGEN_WORKER_URL")
+#  ================================================
+
+# Set by a worker refusing a request because it is full, the coordinator may then safely try another worker
+OVERLOADED_HEADER = "X-TinyGen-Overloaded"
+
+
+def normalize_repo_url(repo_url):
+    """
+    Normalizes a repository URL so that equivalent spellings route to the same worker.
+    e.g. "https://github.com/A/B.git/" and "https://github.com/a/b" map to the same key.
+    """
+    key = repo_url.strip().rstrip("/").lower()
+    if key.endswith(".git"):
+        key = key[: -len(".git")]
+    return key
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16)
+
+
+class ConsistentHashRing:
+    def __init__(self, nodes=(), virtual_nodes=VIRTUAL_NODES):
+        """
+        Consistent hash ring mapping repo URLs to worker ids.
+        Each worker is placed on the ring several times (virtual nodes) so that
+        repos are spread evenly and only ~1/N of them move when a worker joins or leaves.
+        """
+        self.virtual_nodes = virtual_nodes
+        self._ring = []  # sorted list of (hash, node)
+        self.nodes = set()
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.virtual_nodes):
+            bisect.insort(self._ring, (_hash(f"{node}#{i}"), node))
+
+    def remove_node(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        self._ring = [entry for entry in self._ring if entry[1] != node]
+
+    def preference_list(self, repo_url):
+        """
+        Returns every worker in the order they should be tried for this repo.
+        The first entry is the owner; the rest are the fallbacks walking clockwise on the ring.
+        """
+        if not self._ring:
+            return []
+
+        start = bisect.bisect(self._ring, (_hash(normalize_repo_url(repo_url)),))
+        preference = []
+        for i in range(len(self._ring)):
+            node = self._ring[(start + i) % len(self._ring)][1]
+            if node not in preference:
+                preference.append(node)
+                if len(preference) == len(self.nodes):
+                    break
+        return preference
+
+    def owner(self, repo_url):
+        preference = self.preference_list(repo_url)
+        return preference[0] if preference else None
+
+
+class LocalCoordinationStore:
+    def __init__(self, store_dir=STORE_DIR, ttl=HEARTBEAT_INTERVAL * 3):
+        """
+        Local stand-in for a coordination store (etcd, Consul, Redis...).
+        Every worker owns one JSON file in store_dir which it rewrites atomically on each heartbeat,
+        so several local processes can share membership without any locking or outside service.
+        Workers whose heartbeat is older than ttl seconds are treated as gone.
+        """
+        self.store_dir = store_dir
+        self.ttl = ttl
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def _path(self, worker_id):
+        return os.path.join(self.store_dir, f"{worker_id}.json")
+
+    def heartbeat(self, worker_id, url, inflight):
+        record = {
+            "worker_id": worker_id,
+            "url": url,
+            "inflight": inflight,
+            "updated_at": time.time(),
+        }
+        tmp_path = self._path(worker_id) + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._path(worker_id))
+
+    def deregister(self, worker_id):
+        try:
+            os.remove(self._path(worker_id))
+        except FileNotFoundError:
+            pass
+
+    def live_workers(self):
+        """
+        Returns a dict of worker_id -> record for every worker with a fresh heartbeat.
+        """
+        now = time.time()
+        workers = {}
+        for name in os.listdir(self.store_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.store_dir, name), "r") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue  # File removed or being replaced, pick it up on the next read
+            if now - record.get("updated_at", 0) <= self.ttl:
+                workers[record["worker_id"]] = record
+        return workers
+
+
+class Worker:
+    def __init__(
+        self, store, worker_id, url, interval=HEARTBEAT_INTERVAL, max_inflight=MAX_INFLIGHT
+    ):
+        """
+        Worker side of the sharded mode.
+        Tracks the number of in-flight requests and publishes it to the coordination store
+        with a periodic heartbeat so the coordinator can route around overloaded workers.
+        Requests beyond max_inflight are refused before any work starts.
+        """
+        self.store = store
+        self.worker_id = worker_id
+        self.url = url
+        self.interval = interval
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _publish(self):
+        try:
+            with self._lock:
+                self.store.heartbeat(self.worker_id, self.url, self.inflight)
+        except OSError as e:
+            logging.error(f"Failed to publish heartbeat for worker {self.worker_id}: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._publish()
+
+    def start(self):
+        self._publish()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logging.info(f"Worker {self.worker_id} joined at {self.url}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.store.deregister(self.worker_id)
+        logging.info(f"Worker {self.worker_id} left")
+
+    def request_started(self):
+        """
+        Counts a new request, returns False without counting it when the worker is full.
+        """
+        with self._lock:
+            if self.inflight >= self.max_inflight:
+                return False
+            self.inflight += 1
+        self._publish()
+        return True
+
+    def request_finished(self):
+        with self._lock:
+            self.inflight -= 1
+        self._publish()
+
+
+def register_worker(app):
+    """
+    Turns the FastAPI app into a sharded worker: joins the coordination store on startup,
+    leaves it on shutdown and counts in-flight requests for load reporting.
+    """
+    # Without these every worker would advertise the same id and address, possibly the coordinator's own
+    if not WORKER_ID or not WORKER_URL:
+        raise ValueError(
+            "Worker mode requires the TINYGEN_WORKER_ID and TINYGEN_WORKER_URL environment variables."
+        )
+
+    worker = Worker(LocalCoordinationStore(), WORKER_ID, WORKER_URL)
+
+    @app.on_event("startup")
+    async def join_cluster():
+        worker.start()
+
+    @app.on_event("shutdown")
+    async def leave_cluster():
+        worker.stop()
+
+    @app.middleware("http")
+    async def track_inflight(request, call_next):
+        # Only the diff generation requests (POST) do real work and count towards the load
+        if request.method != "POST":
+            return await call_next(request)
+
+        if not worker.request_started():
+            return JSONResponse(
+                status_code=503,
+                content={"detail": f"Worker {worker.worker_id} is overloaded."},
+                headers={OVERLOADED_HEADER: "1"},
+            )
+        try:
+            return await call_next(request)
+        finally:
+            worker.request_finished()
+
+    return worker
+
+
+def worker_path(path):
+    """
+    Returns where a working directory should live for this process.
+    Several workers can run from the same folder, so in worker mode each one gets its own directory.
+    Callers pass a name unique to the request since requests are handled concurrently.
+    """
+    if TINYGEN_MODE != "worker":
+        return path
+    return os.path.join(CHECKOUT_DIR, WORKER_ID, path)
+
+
+_checkout_locks = {}
+_checkout_locks_guard = threading.Lock()
+
+
+def _checkout_lock(cache_path):
+    with _checkout_locks_guard:
+        return _checkout_locks.setdefault(cache_path, threading.Lock())
+
+
+def _evict_checkouts(cache_dir):
+    """
+    Keeps at most MAX_CHECKOUTS cached checkouts, removing the least recently used ones first.
+    This drops repos the worker only served as a fallback or that moved to another worker.
+    Checkouts being used by a request are skipped and picked up on a later call.
+    """
+    checkouts = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            checkouts.append((os.path.getmtime(path), path))
+        except OSError:
+            continue  # Removed by another request meanwhile
+
+    checkouts.sort(reverse=True)
+    for _, path in checkouts[MAX_CHECKOUTS:]:
+        lock = _checkout_lock(path)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            logging.info(f"Removing least recently used checkout {path}")
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            lock.release()
+
+
+def checkout_repo(repo_url, dest):
+    """
+    Clones repo_url into dest.
+    In worker mode the worker keeps a persistent checkout of the last MAX_CHECKOUTS repos it served under
+    CHECKOUT_DIR, so repeated requests for the same repo only pull new commits instead of cloning from scratch.
+    """
+    if TINYGEN_MODE != "worker":
+        Repo.clone_from(repo_url, dest)
+        return
+
+    # Keyed on the URL as given: lowercasing is fine for routing, but paths can be case sensitive on the
+    # host, so two repos differing only by case must not share a checkout
+    cache_key = repo_url.strip().rstrip("/")
+    cache_path = worker_path(
+        os.path.join("cache", hashlib.sha1(cache_key.encode("utf-8")).hexdigest())
+    )
+    # Concurrent requests for the same repo must not pull into the cached checkout at the same time
+    with _checkout_lock(cache_path):
+        if os.path.exists(cache_path):
+            try:
+                logging.info(f"Updating cached checkout {cache_path}...")
+                Repo(cache_path).remotes.origin.pull()
+            except Exception as e:
+                logging.warning(f"Cached checkout {cache_path} is unusable, recloning: {e}")
+                shutil.rmtree(cache_path)
+
+        if not os.path.exists(cache_path):
+            logging.info(f"Cloning the repository into cached checkout {cache_path}...")
+            Repo.clone_from(repo_url, cache_path)
+
+        shutil.copytree(cache_path, dest)
+        os.utime(cache_path)  # Marks the checkout as recently used
+
+    _evict_checkouts(os.path.dirname(cache_path))
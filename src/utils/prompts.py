@@ -159,3 +159,26 @@ def generate_validation_prompt(prompt, diff):
         f"Prompt:\n{prompt}\n\n"
         f"Diff:\n{diff}\n\n"
     )
+
+
+def generate_reuse_validation_prompt(prompt, cached_prompt, diff):
+    """
+    Generates a strict validation prompt for reusing the diff of a similar earlier prompt.
+
+    Args:
+        prompt (str): The new task or instruction.
+        cached_prompt (str): The earlier prompt the diff was generated for.
+        diff (str): The cached code diff.
+
+    Returns:
+        str: A formatted validation prompt asking for an explicit YES/NO verdict.
+    """
+    return (
+        f"A code diff was generated for the prompt: '{cached_prompt}'.\n"
+        f"Decide whether the same diff, unchanged, fully and correctly implements this new prompt: '{prompt}'.\n"
+        "Answer NO if the new prompt targets different code, asks for a different or opposite change, "
+        "or needs anything the diff does not do.\n"
+        "End your answer with a last line that is exactly 'VERDICT: YES' or 'VERDICT: NO'.\n\n"
+        f"New prompt:\n{prompt}\n\n"
+        f"Diff:\n{diff}\n\n"
+    )
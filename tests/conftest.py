@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# The app modules live in src/ and import each other as top level modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Keep the coordination store created when importing the coordinator out of the working tree
+os.environ.setdefault("TINYGEN_STORE_DIR", tempfile.mkdtemp())
+
+# The OpenAI client needs a key when diff.py is imported, tests replace it with a fake client
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+# main.py refuses to start without Supabase credentials, tests replace the client with a fake one
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test.test.test")
@@ -0,0 +1,121 @@
+import asyncio
+import functools
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import coordinator
+import sharding
+from request_data import RequestData
+from sharding import ConsistentHashRing, LocalCoordinationStore, OVERLOADED_HEADER
+
+
+REPO = "https://github.com/tinygen/example"
+WORKERS = ["w1", "w2", "w3"]
+
+
+@pytest.fixture
+def workers(monkeypatch, tmp_path):
+    """
+    Registers three idle workers and returns them in the order the coordinator will try them.
+    """
+    store = LocalCoordinationStore(str(tmp_path))
+    for worker_id in WORKERS:
+        store.heartbeat(worker_id, f"http://{worker_id}", 0)
+    monkeypatch.setattr(coordinator, "store", store)
+    monkeypatch.setattr(coordinator, "ring", ConsistentHashRing())
+    return ConsistentHashRing(WORKERS).preference_list(REPO)
+
+
+def _forward(monkeypatch, handler):
+    """
+    Forwards a request with every worker answered by handler(worker_id), returns the response
+    and the workers that were called.
+    """
+    called = []
+
+    def handle(request):
+        called.append(request.url.host)
+        return handler(request.url.host, request)
+
+    transport = httpx.MockTransport(handle)
+    monkeypatch.setattr(
+        coordinator.httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=transport)
+    )
+    response = asyncio.run(coordinator.forward("/generate-diff", RequestData(repoUrl=REPO, prompt="p")))
+    return response, called
+
+
+def test_forward_passes_response_through(monkeypatch, workers):
+    response, called = _forward(
+        monkeypatch, lambda worker_id, request: httpx.Response(200, text="plain", headers={"content-type": "text/plain"})
+    )
+
+    assert called == workers[:1]
+    assert response.body == b"plain"
+    assert response.headers["content-type"].startswith("text/plain")
+    assert response.headers["X-TinyGen-Worker"] == workers[0]
+
+
+def test_forward_returns_server_errors_without_retrying(monkeypatch, workers):
+    response, called = _forward(monkeypatch, lambda worker_id, request: httpx.Response(500, text="boom"))
+
+    assert called == workers[:1]
+    assert (response.status_code, response.body) == (500, b"boom")
+
+
+def test_forward_tries_next_worker_when_unreachable_or_overloaded(monkeypatch, workers):
+    def handler(worker_id, request):
+        if worker_id == workers[0]:
+            raise httpx.ConnectError("refused", request=request)
+        if worker_id == workers[1]:
+            return httpx.Response(503, json={"detail": "overloaded"}, headers={OVERLOADED_HEADER: "1"})
+        return httpx.Response(200, json={"diff": "d"})
+
+    response, called = _forward(monkeypatch, handler)
+
+    assert called == workers
+    assert response.headers["X-TinyGen-Worker"] == workers[2]
+
+
+def test_forward_does_not_retry_after_read_timeout(monkeypatch, workers):
+    def handler(worker_id, request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    with pytest.raises(HTTPException) as error:
+        _forward(monkeypatch, handler)
+
+    assert error.value.status_code == 504
+    assert workers[0] in error.value.detail
+
+
+def test_forward_fails_when_every_worker_is_full(monkeypatch, workers):
+    def handler(worker_id, request):
+        return httpx.Response(503, json={"detail": "overloaded"}, headers={OVERLOADED_HEADER: "1"})
+
+    with pytest.raises(HTTPException) as error:
+        _forward(monkeypatch, handler)
+
+    assert error.value.status_code == 503
+
+
+def test_worker_refuses_requests_beyond_capacity(monkeypatch):
+    monkeypatch.setattr(sharding, "WORKER_ID", "w1")
+    monkeypatch.setattr(sharding, "WORKER_URL", "http://w1")
+    app = FastAPI()
+    worker = sharding.register_worker(app)
+
+    @app.post("/generate-diff")
+    def generate_diff():
+        return {"diff": "d"}
+
+    with TestClient(app) as client:
+        assert client.post("/generate-diff").status_code == 200
+
+        worker.inflight = worker.max_inflight
+        response = client.post("/generate-diff")
+
+    assert response.status_code == 503
+    assert response.headers[OVERLOADED_HEADER] == "1"
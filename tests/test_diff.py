@@ -0,0 +1,48 @@
+import pytest
+from fastapi import HTTPException
+
+import diff
+
+
+class FakeClient:
+    def __init__(self, answer):
+        self.answer = answer
+        self.prompts = []
+
+    def create_completion(self, prompt):
+        self.prompts.append(prompt)
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        "The diff adds the type hints.\nVERDICT: YES",
+        "Looks good.\n**Verdict: yes**",
+    ],
+)
+def test_validate_cached_diff_accepts_explicit_yes(monkeypatch, answer):
+    client = FakeClient(answer)
+    monkeypatch.setattr(diff, "llm_client", client)
+
+    assert diff.validate_cached_diff("DIFF", "add typing to utils", "add type hints to utils")
+    assert len(client.prompts) == 1
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        "The diff is incorrect.\nVERDICT: NO",
+        "The diff is incorrect, it changes main.py instead of utils.py.",
+        "This is correct and fully addresses the issue.",
+        "VERDICT: YES\nActually no, it targets the wrong file.",
+        "",
+        HTTPException(status_code=500, detail="OpenAI API error"),
+    ],
+)
+def test_validate_cached_diff_rejects_anything_else(monkeypatch, answer):
+    monkeypatch.setattr(diff, "llm_client", FakeClient(answer))
+
+    assert not diff.validate_cached_diff("DIFF", "add typing to utils", "add type hints to utils")
@@ -0,0 +1,94 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+from git import Repo
+
+import main
+
+
+class FakeTable:
+    def __init__(self, columns):
+        self.columns = columns
+        self.inserted = []
+
+    def insert(self, row):
+        self.row = row
+        return self
+
+    def execute(self):
+        missing = set(self.row) - self.columns
+        if missing:
+            raise Exception(f"Could not find the '{missing.pop()}' column of 'tinygen_requests'")
+        self.inserted.append(self.row)
+        self.data = [self.row]
+        return self
+
+
+class FakeSupabase:
+    def __init__(self, columns):
+        self.requests = FakeTable(columns)
+
+    def table(self, name):
+        assert name == "tinygen_requests"
+        return self.requests
+
+
+ROW = {"repo_url": "r", "commit_sha": "abc", "prompt": "p", "diff": "d", "summary": "s"}
+
+
+def test_insert_request_stores_commit_sha(monkeypatch):
+    fake = FakeSupabase(set(ROW))
+    monkeypatch.setattr(main, "supabase", fake)
+    monkeypatch.setattr(main, "commit_sha_supported", True)
+
+    main.insert_request(ROW)
+
+    assert fake.requests.inserted == [ROW]
+
+
+def test_insert_request_falls_back_without_commit_sha_column(monkeypatch):
+    fake = FakeSupabase(set(ROW) - {"commit_sha"})
+    monkeypatch.setattr(main, "supabase", fake)
+    monkeypatch.setattr(main, "commit_sha_supported", True)
+
+    main.insert_request(ROW)
+    main.insert_request(ROW)
+
+    expected = {k: v for k, v in ROW.items() if k != "commit_sha"}
+    assert fake.requests.inserted == [expected, expected]
+    assert main.commit_sha_supported is False
+
+
+def _run_in(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "worker_path", lambda path: str(tmp_path / path))
+    monkeypatch.setattr(main, "supabase", FakeSupabase(set(ROW)))
+    monkeypatch.setattr(main, "commit_sha_supported", True)
+
+
+def test_failed_request_removes_request_folder(monkeypatch, tmp_path):
+    _run_in(monkeypatch, tmp_path)
+
+    def failing_checkout(repo_url, dest):
+        os.makedirs(dest)
+        raise RuntimeError("clone failed")
+
+    monkeypatch.setattr(main, "checkout_repo", failing_checkout)
+
+    for endpoint in (main.generate_diff, main.generate_diff_no_code):
+        with pytest.raises(HTTPException):
+            endpoint(main.RequestData(repoUrl="r", prompt="p"))
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_successful_request_removes_request_folder(monkeypatch, tmp_path):
+    _run_in(monkeypatch, tmp_path)
+    monkeypatch.setattr(main, "checkout_repo", lambda repo_url, dest: Repo.init(dest).index.commit("init"))
+    monkeypatch.setattr(main, "generate_or_reuse_diff", lambda *args: ("DIFF", "SUMMARY"))
+    monkeypatch.setattr(main, "output_modified_code", lambda repo_dir, diff: None)
+
+    for endpoint in (main.generate_diff, main.generate_diff_no_code):
+        assert endpoint(main.RequestData(repoUrl="r", prompt="p")) == {"summary": "SUMMARY", "diff": "DIFF"}
+
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,156 @@
+import pytest
+
+from prompt_cache import CACHE_THRESHOLD, PromptCache
+
+
+REPO = "https://github.com/tinygen/example"
+COMMIT = "abc123"
+BASE_PROMPT = "add type hints to utils"
+
+HISTORY = [
+    "add logging to main",
+    "fix the parser bug",
+    "add docstrings to utils",
+    "add tests for the parser",
+]
+
+
+def _cache(history=(), cached_prompt=BASE_PROMPT):
+    cache = PromptCache()
+    for prompt in history:
+        cache.add(REPO, COMMIT, prompt, f"diff for {prompt}", f"summary for {prompt}")
+    cache.add(REPO, COMMIT, cached_prompt, "CACHED DIFF", "CACHED SUMMARY")
+    return cache
+
+
+@pytest.mark.parametrize("history", [(), HISTORY])
+@pytest.mark.parametrize(
+    "cached_prompt, prompt",
+    [
+        ("add type hints to utils", "Add type hints to utils."),
+        ("add type hints to utils", "please add type hints to the utils"),
+        ("add type hints to utils", "Add type-hints to utils.py"),
+        ("add logging to main", "add logging to main.py"),
+        ("fix the parser bug", "Fix the parser bug!"),
+    ],
+)
+def test_rewordings_hit(history, cached_prompt, prompt):
+    entry, similarity = _cache(history, cached_prompt).lookup(REPO, COMMIT, prompt)
+
+    assert entry is not None and entry["diff"] == "CACHED DIFF"
+    assert similarity >= CACHE_THRESHOLD
+
+
+@pytest.mark.parametrize("history", [(), HISTORY])
+@pytest.mark.parametrize(
+    "cached_prompt, prompt",
+    [
+        # Swapped arguments
+        ("rename foo to bar", "rename bar to foo"),
+        ("convert foo to bar", "convert bar to foo"),
+        ("move helpers from utils to core", "move helpers from core to utils"),
+        # Wider scope
+        ("add type hints to utils", "add type hints to utils and main"),
+        # Different task, target or action
+        ("add tests for utils", "add type hints to utils tests"),
+        ("add type hints to utils", "add type hints to main"),
+        ("add type hints to utils", "remove type hints from utils"),
+        ("add type hints to utils", "add tests to utils"),
+    ],
+)
+def test_different_tasks_miss(history, cached_prompt, prompt):
+    entry, similarity = _cache(history, cached_prompt).lookup(REPO, COMMIT, prompt)
+
+    assert entry is None
+    assert similarity < CACHE_THRESHOLD
+
+
+def test_partitions_by_repo_and_commit():
+    cache = _cache()
+
+    assert cache.lookup(REPO, "other-commit", BASE_PROMPT)[0] is None
+    assert cache.lookup("https://github.com/tinygen/other", COMMIT, BASE_PROMPT)[0] is None
+    assert cache.lookup("https://github.com/Tinygen/Example.git", COMMIT, BASE_PROMPT)[0] is not None
+
+
+def test_evicts_least_recently_used():
+    cache = PromptCache(max_per_repo=2, max_repos=2)
+    cache.add(REPO, COMMIT, "add logging to main", "d1", "s1")
+    cache.add(REPO, COMMIT, "fix the parser bug", "d2", "s2")
+    cache.lookup(REPO, COMMIT, "add logging to main")  # Refreshes the first entry
+    cache.add(REPO, COMMIT, "add docstrings to utils", "d3", "s3")
+
+    assert cache.lookup(REPO, COMMIT, "fix the parser bug")[0] is None
+    assert cache.lookup(REPO, COMMIT, "add logging to main")[0] is not None
+
+    cache.add("https://github.com/tinygen/b", COMMIT, "p", "d", "s")
+    cache.add("https://github.com/tinygen/c", COMMIT, "p", "d", "s")
+
+    assert cache.stats()["repos"] == 2
+    assert cache.lookup(REPO, COMMIT, "add logging to main")[0] is None
+
+
+def test_new_commits_evict_older_commits_of_the_same_repo():
+    cache = PromptCache(max_per_repo=2, max_repos=2)
+    other_repo = "https://github.com/tinygen/other"
+    cache.add(other_repo, COMMIT, "add logging to main", "d", "s")
+    for i in range(5):
+        cache.add(REPO, f"commit-{i}", "add logging to main", f"d{i}", "s")
+
+    # Every commit of the busy repo counts towards its own limit, the other repo is untouched
+    assert cache.stats()["repos"] == 2
+    assert cache.stats()["entries"] == 3
+    assert cache.lookup(other_repo, COMMIT, "add logging to main")[0] is not None
+    assert cache.lookup(REPO, "commit-2", "add logging to main")[0] is None
+    assert cache.lookup(REPO, "commit-3", "add logging to main")[0]["diff"] == "d3"
+    assert cache.lookup(REPO, "commit-4", "add logging to main")[0]["diff"] == "d4"
+
+
+def test_failed_results_are_not_cached():
+    cache = PromptCache()
+    cache.add(REPO, COMMIT, BASE_PROMPT, None, "Reflection failed after multiple attempts.")
+
+    assert cache.stats()["entries"] == 0
+
+
+def test_stats_count_hits_misses_and_rejections():
+    cache = _cache()
+    cache.lookup(REPO, COMMIT, BASE_PROMPT)
+    cache.record_validation(True)
+    cache.lookup(REPO, COMMIT, "Add type hints to utils.")
+    cache.record_validation(False)
+    cache.lookup(REPO, COMMIT, "add logging to main")
+
+    stats = cache.stats()
+
+    assert (stats["lookups"], stats["hits"], stats["rejected"], stats["misses"]) == (3, 1, 1, 1)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+
+
+class FakeQuery:
+    def __init__(self, rows):
+        self.data = rows
+
+    def __getattr__(self, name):
+        # Every query builder step (select, not_, is_, order, limit...) returns the query itself
+        return lambda *args, **kwargs: self
+
+    @property
+    def not_(self):
+        return self
+
+    def execute(self):
+        return self
+
+
+def test_warm_from_history_keeps_owned_repos():
+    rows = [
+        {"repo_url": repo, "commit_sha": COMMIT, "prompt": BASE_PROMPT, "diff": "d", "summary": "s"}
+        for repo in (REPO, "https://github.com/tinygen/other")
+    ]
+    cache = PromptCache()
+
+    cache.warm_from_history(FakeQuery(rows), owns_repo=lambda repo_url: repo_url == REPO)
+
+    assert cache.stats()["entries"] == 1
+    assert cache.lookup(REPO, COMMIT, BASE_PROMPT)[0] is not None
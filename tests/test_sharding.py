@@ -0,0 +1,145 @@
+import os
+import time
+
+from git import Repo
+
+import coordinator
+import sharding
+from sharding import ConsistentHashRing, LocalCoordinationStore, MAX_INFLIGHT
+
+
+REPOS = [f"https://github.com/tinygen/repo-{i}" for i in range(1000)]
+
+
+def test_same_repo_spellings_route_to_same_owner():
+    ring = ConsistentHashRing(["w1", "w2", "w3"])
+
+    assert ring.owner("https://github.com/Tinygen/Repo-1.git/") == ring.owner(
+        "https://github.com/tinygen/repo-1"
+    )
+
+
+def test_join_only_moves_repos_to_new_worker():
+    ring = ConsistentHashRing(["w1", "w2", "w3"])
+    before = {repo: ring.owner(repo) for repo in REPOS}
+
+    ring.add_node("w4")
+    moved = [repo for repo in REPOS if ring.owner(repo) != before[repo]]
+
+    assert all(ring.owner(repo) == "w4" for repo in moved)
+    # Roughly a quarter of the repos should move to the fourth worker
+    assert 150 < len(moved) < 350
+
+
+def test_leave_only_moves_repos_of_departed_worker():
+    ring = ConsistentHashRing(["w1", "w2", "w3", "w4"])
+    before = {repo: ring.owner(repo) for repo in REPOS}
+
+    ring.remove_node("w4")
+
+    for repo in REPOS:
+        if before[repo] == "w4":
+            assert ring.owner(repo) in {"w1", "w2", "w3"}
+        else:
+            assert ring.owner(repo) == before[repo]
+
+
+def test_preference_list_contains_every_worker_once():
+    ring = ConsistentHashRing(["w1", "w2", "w3"])
+
+    preference = ring.preference_list(REPOS[0])
+
+    assert sorted(preference) == ["w1", "w2", "w3"]
+    assert preference[0] == ring.owner(REPOS[0])
+
+
+def test_live_workers_drops_expired_heartbeats(tmp_path):
+    store = LocalCoordinationStore(str(tmp_path), ttl=0.2)
+    store.heartbeat("w1", "http://127.0.0.1:8001", 0)
+
+    assert set(store.live_workers()) == {"w1"}
+
+    time.sleep(0.3)
+    store.heartbeat("w2", "http://127.0.0.1:8002", 0)
+
+    assert set(store.live_workers()) == {"w2"}
+
+
+def test_live_workers_drops_deregistered_workers(tmp_path):
+    store = LocalCoordinationStore(str(tmp_path))
+    store.heartbeat("w1", "http://127.0.0.1:8001", 0)
+
+    store.deregister("w1")
+
+    assert store.live_workers() == {}
+
+
+def _use_store(monkeypatch, tmp_path, inflight):
+    store = LocalCoordinationStore(str(tmp_path))
+    for worker_id, count in inflight.items():
+        store.heartbeat(worker_id, f"http://{worker_id}", count)
+    monkeypatch.setattr(coordinator, "store", store)
+    monkeypatch.setattr(coordinator, "ring", ConsistentHashRing())
+
+
+def test_route_prefers_owner(monkeypatch, tmp_path):
+    _use_store(monkeypatch, tmp_path, {"w1": 0, "w2": 0, "w3": 0})
+
+    routed = [worker["worker_id"] for worker in coordinator.route(REPOS[0])]
+
+    assert routed == coordinator.ring.preference_list(REPOS[0])
+
+
+def test_route_falls_back_when_owner_overloaded(monkeypatch, tmp_path):
+    owner, second, third = ConsistentHashRing(["w1", "w2", "w3"]).preference_list(REPOS[0])
+    _use_store(monkeypatch, tmp_path, {owner: MAX_INFLIGHT, second: 0, third: MAX_INFLIGHT + 1})
+
+    routed = [worker["worker_id"] for worker in coordinator.route(REPOS[0])]
+
+    # Workers with spare capacity first in ring order, then overloaded ones least loaded first
+    assert routed == [second, owner, third]
+
+
+def test_route_rebalances_when_worker_leaves(monkeypatch, tmp_path):
+    _use_store(monkeypatch, tmp_path, {"w1": 0, "w2": 0})
+    owner = coordinator.route(REPOS[0])[0]["worker_id"]
+
+    coordinator.store.deregister(owner)
+    routed = [worker["worker_id"] for worker in coordinator.route(REPOS[0])]
+
+    assert routed == [w for w in ("w1", "w2") if w != owner]
+
+
+def test_route_without_workers_is_empty(monkeypatch, tmp_path):
+    _use_store(monkeypatch, tmp_path, {})
+
+    assert coordinator.route(REPOS[0]) == []
+
+
+def _make_repo(path):
+    repo = Repo.init(path)
+    (path / "README.md").write_text(str(path))
+    repo.index.add(["README.md"])
+    repo.index.commit("init")
+    return str(path)
+
+
+def test_checkouts_are_cached_and_least_recently_used_evicted(monkeypatch, tmp_path):
+    monkeypatch.setattr(sharding, "TINYGEN_MODE", "worker")
+    monkeypatch.setattr(sharding, "WORKER_ID", "w1")
+    monkeypatch.setattr(sharding, "CHECKOUT_DIR", str(tmp_path / "checkouts"))
+    monkeypatch.setattr(sharding, "MAX_CHECKOUTS", 2)
+    repos = [_make_repo(tmp_path / f"repo{i}") for i in range(3)]
+    cache_dir = tmp_path / "checkouts" / "w1" / "cache"
+
+    sharding.checkout_repo(repos[0], str(tmp_path / "dest0"))
+    time.sleep(0.01)
+    sharding.checkout_repo(repos[1], str(tmp_path / "dest1"))
+    time.sleep(0.01)
+    sharding.checkout_repo(repos[0], str(tmp_path / "dest0-again"))  # repo0 is now the most recent
+    time.sleep(0.01)
+    sharding.checkout_repo(repos[2], str(tmp_path / "dest2"))
+
+    cached = {Repo(cache_dir / name).remotes.origin.url for name in os.listdir(cache_dir)}
+    assert cached == {repos[0], repos[2]}
+    assert (tmp_path / "dest0-again" / "README.md").read_text() == repos[0]